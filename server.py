@@ -1,26 +1,73 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from brotli_asgi import BrotliMiddleware
 import os
-import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime
-from bson import ObjectId
-from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Motor sizes its thread pool from this at import time, so .env is loaded first
+os.environ.setdefault('MOTOR_MAX_WORKERS', '8')
+from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import gzip
+import logging
+import time
+import brotli
+import orjson
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import List, Optional, Dict, Any, Callable
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from emergentintegrations.llm.chat import LlmChat, UserMessage
+import redis.asyncio as aioredis
+from redisvl.extensions.llmcache import SemanticCache
+from redisvl.query.filter import Tag
+from redisvl.utils.vectorize import HFTextVectorizer
+import numpy as np
+import sim_kernels
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    # Motor runs each operation on its executor thread, so more connections
+    # than MOTOR_MAX_WORKERS can never be in use at once. No idle minimum,
+    # since every Uvicorn worker process opens its own pool.
+    maxPoolSize=int(os.environ['MOTOR_MAX_WORKERS']),
+    minPoolSize=0,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=2000,
+    compressors="zstd,zlib"
+)
 db = client[os.environ['DB_NAME']]
 
+# Redis connection
+redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+redis_client = aioredis.from_url(redis_url, decode_responses=True)
+
+# Semantic cache for AI-generated lessons, connected in a startup hook.
+# Stays None if Redis or the embedding model is unavailable.
+llmcache: Optional[SemanticCache] = None
+
+def build_lesson_cache() -> SemanticCache:
+    """Load the embedding model and connect the lesson cache to Redis"""
+    return SemanticCache(
+        name="finstart_lessons",
+        redis_url=redis_url,
+        distance_threshold=0.1,
+        vectorizer=HFTextVectorizer("redis/langcache-embed-v1"),
+        filterable_fields=[{"name": "difficulty", "type": "tag"}],
+        ttl=86400
+    )
+
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Logging
@@ -160,20 +207,83 @@ def get_modules_data():
         }
     ]
 
-async def generate_lesson_content(topic: str, difficulty: str = "beginner") -> Dict[str, Any]:
-    """Generate lesson content using AI"""
-    try:
-        api_key = os.getenv('EMERGENT_LLM_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="API key not configured")
-        
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"lesson_{topic}",
-            system_message="You are a financial education expert creating engaging, practical lessons for ages 13-25. Focus on real-world examples, simple explanations, and actionable advice."
-        ).with_model("openai", "gpt-4o-mini")
-        
-        prompt = f"""Create a comprehensive financial education lesson on: {topic}
+# Static data is built once at import time instead of per request
+MODULES_ADAPTER = TypeAdapter(List[Module])
+MODULES = MODULES_ADAPTER.validate_python(get_modules_data())
+
+SCENARIOS = {
+    "student": {
+        "title": "Student Financial Scenario",
+        "advice": [
+            "Focus on building emergency fund (3 months expenses)",
+            "Start with small savings habit (10-20% of any income)",
+            "Avoid unnecessary debt, especially consumer loans",
+            "Learn about compound interest early"
+        ],
+        "suggested_actions": [
+            "Open a basic savings account",
+            "Track all expenses for one month",
+            "Set up automatic savings transfer"
+        ]
+    },
+    "first_job": {
+        "title": "First Job Financial Scenario",
+        "advice": [
+            "Build 6-month emergency fund",
+            "Start retirement savings immediately (even small amounts)",
+            "Avoid lifestyle inflation"
+        ],
+        "suggested_actions": [
+            "Set up automatic investment (SIP) of ₹500-1000/month",
+            "Get health insurance",
+            "Create and follow a budget"
+        ]
+    },
+    "tax_planning": {
+        "title": "Legal Tax Planning",
+        "advice": [
+            "Utilize Section 80C deductions (up to ₹1.5 lakh)",
+            "Consider PPF, ELSS, or EPF contributions",
+            "Keep records of all tax-saving investments",
+            "File returns on time to avoid penalties"
+        ],
+        "disclaimer": "This is educational information only. Consult a tax professional for personalized advice. Never engage in tax evasion - it is illegal."
+    }
+}
+
+# Static responses are serialized once; first_job fills in the income line per request
+MODULES_BYTES = MODULES_ADAPTER.dump_json(MODULES)
+MODULES_ENCODED = {
+    "br": brotli.compress(MODULES_BYTES, quality=11),
+    "gzip": gzip.compress(MODULES_BYTES, compresslevel=9)
+}
+SCENARIO_BYTES = {
+    scenario_type: orjson.dumps(scenario)
+    for scenario_type, scenario in SCENARIOS.items()
+}
+SCENARIO_BYTES["first_job"] = orjson.dumps({
+    **SCENARIOS["first_job"],
+    "advice": SCENARIOS["first_job"]["advice"] + ["Save at least 20% of income: ₹{INCOME20}"]
+})
+
+LESSON_SYSTEM_MESSAGE = "You are a financial education expert creating engaging, practical lessons for ages 13-25. Focus on real-world examples, simple explanations, and actionable advice. Always respond with a single JSON object and nothing else."
+
+def get_lesson_chat(topic: str) -> LlmChat:
+    """Create the LLM chat used to write a lesson"""
+    api_key = os.getenv('EMERGENT_LLM_KEY')
+    if not api_key:
+        raise HTTPException(status_code=500, detail="API key not configured")
+    
+    # A fresh chat per call: LlmChat keeps conversation history per instance
+    return LlmChat(
+        api_key=api_key,
+        session_id=f"lesson_{topic}",
+        system_message=LESSON_SYSTEM_MESSAGE
+    ).with_model("openai", "gpt-4o-mini")
+
+def get_lesson_prompt(topic: str, difficulty: str) -> str:
+    """Build the lesson generation prompt"""
+    return f"""Create a comprehensive financial education lesson on: {topic}
         
 Difficulty level: {difficulty}
 
@@ -185,29 +295,475 @@ Provide a JSON response with:
 5. daily_tip: One specific, actionable tip they can implement today
 
 Make it practical, relatable, and focused on empowering young people to make smart money decisions."""
+
+def parse_lesson_response(topic: str, response: str) -> Optional[Dict[str, Any]]:
+    """Parse the AI response into lesson fields, or None if it is not a JSON object"""
+    text = response.strip()
+    # Models sometimes wrap JSON output in a ```json fence
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        lesson_data = orjson.loads(text)
+    except orjson.JSONDecodeError as e:
+        logger.warning(f"AI response for '{topic}' was not valid JSON: {e}")
+        lesson_data = None
+    
+    return lesson_data if isinstance(lesson_data, dict) else None
+
+def fallback_lesson(topic: str, response: str) -> Dict[str, Any]:
+    """Structured lesson for an AI response that is not a JSON object"""
+    return {
+        "title": topic,
+        "content": response[:400],
+        "key_points": ["Understand the basics", "Apply in real life", "Track progress"],
+        "real_example": "Example scenario based on this concept.",
+        "daily_tip": "Start small and stay consistent."
+    }
+
+async def get_cached_lesson(topic: str, difficulty: str) -> Optional[Dict[str, Any]]:
+    """Look up a lesson generated for a similar topic+difficulty"""
+    # The cache is an optimization; if it is unavailable, generate as usual
+    if llmcache is None:
+        return None
+    try:
+        # Embedding the prompt runs a model on the CPU, so keep it off the event loop
+        hit = await asyncio.to_thread(
+            llmcache.check,
+            prompt=f"{topic}|{difficulty}",
+            filter_expression=Tag("difficulty") == difficulty
+        )
+        return orjson.loads(hit[0]["response"]) if hit else None
+    except Exception as e:
+        logger.warning(f"Error reading lesson cache: {e}")
+        return None
+
+async def cache_lesson(topic: str, difficulty: str, lesson_data: Dict[str, Any]):
+    """Store a generated lesson in the semantic cache"""
+    if llmcache is None:
+        return
+    try:
+        await asyncio.to_thread(
+            llmcache.store,
+            prompt=f"{topic}|{difficulty}",
+            response=orjson.dumps(lesson_data).decode(),
+            filters={"difficulty": difficulty}
+        )
+    except Exception as e:
+        logger.warning(f"Error writing lesson cache: {e}")
+
+def pick_encoding(accept_encoding: str, available: List[str]) -> Optional[str]:
+    """Pick the available encoding with the highest q-value in Accept-Encoding
+    
+    Encodings with q=0 are refused; ties go to the earlier entry in available.
+    """
+    q_values = {}
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name.strip():
+            q_values[name.strip().lower()] = q
+    
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = q_values.get(encoding, q_values.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+async def generate_lesson_content(topic: str, difficulty: str = "beginner") -> Dict[str, Any]:
+    """Generate lesson content using AI"""
+    try:
+        # Similar topic+difficulty prompts reuse a previously generated lesson
+        lesson_data = await get_cached_lesson(topic, difficulty)
+        if lesson_data:
+            return lesson_data
         
-        user_message = UserMessage(text=prompt)
+        chat = get_lesson_chat(topic)
+        user_message = UserMessage(text=get_lesson_prompt(topic, difficulty))
         response = await chat.send_message(user_message)
         
-        # Parse AI response
-        import json
-        try:
-            lesson_data = json.loads(response)
-        except:
-            # If not JSON, create structured response
-            lesson_data = {
-                "title": topic,
-                "content": response[:400],
-                "key_points": ["Understand the basics", "Apply in real life", "Track progress"],
-                "real_example": "Example scenario based on this concept.",
-                "daily_tip": "Start small and stay consistent."
-            }
-        
+        lesson_data = parse_lesson_response(topic, response)
+        if not lesson_data:
+            # Don't cache the fallback, so the next request retries the AI
+            return fallback_lesson(topic, response)
+        await cache_lesson(topic, difficulty, lesson_data)
         return lesson_data
     except Exception as e:
         logger.error(f"Error generating lesson: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate lesson: {str(e)}")
 
+async def save_generated_lesson(request: LessonGenerateRequest, lesson_content: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a lesson from generated content and save it"""
+    # Create lesson object
+    lesson_id = f"{request.module_id}_{request.topic.lower().replace(' ', '_')}"
+    lesson = {
+        "id": lesson_id,
+        "module_id": request.module_id,
+        "title": lesson_content.get("title", request.topic),
+        "content": lesson_content.get("content", ""),
+        "duration_minutes": 3,
+        "key_points": lesson_content.get("key_points", []),
+        "real_example": lesson_content.get("real_example", ""),
+        "quiz_questions": [],
+        "daily_tip": lesson_content.get("daily_tip", ""),
+        "order": 1,
+        "created_at": datetime.utcnow()
+    }
+    
+    # Save to database
+    await db.lessons.update_one(
+        {"id": lesson_id},
+        {"$set": lesson},
+        upsert=True
+    )
+    
+    return lesson
+
+# === Progress Cache ===
+
+# Completed lessons and quiz scores are mirrored into a Redis SET and HASH per
+# user so membership checks and progress reads skip the growing Mongo arrays.
+# MongoDB stays the durable copy: Redis is only updated after the Mongo write
+# succeeds, and is reloaded from MongoDB while either key lacks its "" marker
+# (e.g. after one of them is evicted).
+
+def progress_keys(user_id: str) -> tuple:
+    """Redis keys holding a user's completed lessons and quiz scores"""
+    return f"prog:{user_id}:done", f"prog:{user_id}:quiz"
+
+async def load_progress(user_id: str):
+    """Load completed lessons and quiz scores from MongoDB into Redis"""
+    done_key, quiz_key = progress_keys(user_id)
+    progress = await db.progress.find_one(
+        {"user_id": user_id},
+        {"_id": 0, "completed_lessons": 1, "quiz_scores": 1}
+    ) or {}
+    pipe = redis_client.pipeline()
+    # The empty member/field marks each key as loaded even when it has no data
+    pipe.sadd(done_key, "", *progress.get("completed_lessons", []))
+    pipe.hset(quiz_key, "", "")
+    # HSETNX keeps any newer score written since the Mongo read
+    for lesson_id, score in progress.get("quiz_scores", {}).items():
+        pipe.hsetnx(quiz_key, lesson_id, score)
+    await pipe.execute()
+
+def check_progress_cached(pipe, user_id: str):
+    """Queue the checks for both progress keys' loaded markers on a pipeline"""
+    done_key, quiz_key = progress_keys(user_id)
+    pipe.sismember(done_key, "")
+    pipe.hexists(quiz_key, "")
+
+async def cache_progress(user_id: str):
+    """Load completed lessons and quiz scores into Redis if not already cached"""
+    pipe = redis_client.pipeline()
+    check_progress_cached(pipe, user_id)
+    if not all(await pipe.execute()):
+        await load_progress(user_id)
+
+# === Progress Write Batching ===
+
+PROGRESS_BATCH_SIZE = 100
+PROGRESS_BATCH_WINDOW = 0.01  # seconds
+
+progress_queue: asyncio.Queue = asyncio.Queue()
+progress_flusher: Optional[asyncio.Task] = None
+
+async def queue_progress_write(op: UpdateOne) -> None:
+    """Queue a progress update and wait until its batch has been written"""
+    future = asyncio.get_running_loop().create_future()
+    await progress_queue.put((op, future))
+    await future
+
+async def write_progress_batch(batch: List[tuple]) -> None:
+    """Write a batch of queued progress updates with a single bulk_write"""
+    try:
+        # Ordered so updates to the same user document apply in submission order
+        await db.progress.bulk_write([op for op, _ in batch], ordered=True)
+        failed_at, error = len(batch), None
+    except BulkWriteError as e:
+        # Ops before the first failure were applied, the rest were not run.
+        # A write concern error alone carries no index, so fail the whole batch.
+        write_errors = e.details.get("writeErrors") or [{"index": 0}]
+        failed_at, error = write_errors[0]["index"], e
+    except Exception as e:
+        failed_at, error = 0, e
+    
+    if error:
+        logger.error(f"Error writing progress batch: {error}")
+    for i, (_, future) in enumerate(batch):
+        if future.done():
+            continue
+        if i < failed_at:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+async def flush_progress_writes():
+    """Drain the progress queue, flushing every batch window or batch size
+    
+    A None item stops the flusher once everything queued before it is written.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        item = await progress_queue.get()
+        if item is None:
+            return
+        batch = [item]
+        deadline = loop.time() + PROGRESS_BATCH_WINDOW
+        while len(batch) < PROGRESS_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(progress_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        try:
+            await write_progress_batch(batch)
+        except Exception as e:
+            # Never let the flusher die, or queued writes would wait forever
+            logger.error(f"Error flushing progress batch: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+# === Activity Tracking ===
+
+# last_active is kept in Redis and written back to MongoDB once per interval,
+# so frequent requests cost one Mongo write per user per minute
+ACTIVITY_FLUSH_INTERVAL = 60  # seconds
+ACTIVITY_TTL = 3600  # seconds
+ACTIVITY_DIRTY_KEY = "active:dirty"
+
+activity_flusher: Optional[asyncio.Task] = None
+
+def touch_last_active(pipe, user_id: str):
+    """Queue the commands recording activity for a user on a Redis pipeline"""
+    pipe.set(f"active:{user_id}", int(time.time()), ex=ACTIVITY_TTL)
+    pipe.sadd(ACTIVITY_DIRTY_KEY, user_id)
+
+async def write_last_active():
+    """Write last_active for users active since the previous flush to MongoDB"""
+    pipe = redis_client.pipeline()
+    pipe.smembers(ACTIVITY_DIRTY_KEY)
+    pipe.delete(ACTIVITY_DIRTY_KEY)
+    user_ids, _ = await pipe.execute()
+    if not user_ids:
+        return
+    
+    user_ids = list(user_ids)
+    try:
+        timestamps = await redis_client.mget([f"active:{user_id}" for user_id in user_ids])
+        ops = [
+            UpdateOne(
+                {"user_id": user_id},
+                {"$set": {"last_active": datetime.utcfromtimestamp(int(ts))}},
+                upsert=True
+            )
+            for user_id, ts in zip(user_ids, timestamps)
+            if ts
+        ]
+        if ops:
+            await db.progress.bulk_write(ops, ordered=False)
+    except BaseException:
+        # Mark the users dirty again so the next flush retries them
+        await redis_client.sadd(ACTIVITY_DIRTY_KEY, *user_ids)
+        raise
+
+async def flush_last_active():
+    """Write last_active back to MongoDB every ACTIVITY_FLUSH_INTERVAL"""
+    while True:
+        await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+        try:
+            await write_last_active()
+        except Exception as e:
+            logger.error(f"Error writing last_active: {e}")
+
+# === Simulations ===
+
+# Upper bounds on client-controlled array sizes
+MAX_SCHEDULE_MONTHS = 1200  # 100 years
+MAX_SWEEP_RATES = 100
+
+def schedule_months(months: Any) -> int:
+    """Validate the length of a requested monthly schedule"""
+    if not isinstance(months, (int, float)) or not 0 <= months <= MAX_SCHEDULE_MONTHS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Schedule length must be between 0 and {MAX_SCHEDULE_MONTHS} months"
+        )
+    # Truncating would give a schedule that disagrees with the totals computed from months
+    if months != int(months):
+        raise HTTPException(status_code=400, detail="Schedule length must be a whole number of months")
+    return int(months)
+
+def sweep_rates(rates: Any) -> np.ndarray:
+    """Validate the annual rates (in %) of a sensitivity sweep"""
+    if (
+        not isinstance(rates, list)
+        or len(rates) > MAX_SWEEP_RATES
+        or not all(isinstance(r, (int, float)) for r in rates)
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"rates must be a list of at most {MAX_SWEEP_RATES} numbers"
+        )
+    return np.asarray(rates, dtype=float)
+
+def compound_interest(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Compound interest on a principal, optionally with a monthly schedule and rate sweep"""
+    principal = inputs.get("principal", 0)
+    rate = inputs.get("rate", 0) / 100
+    time = inputs.get("time", 0)
+    frequency = inputs.get("frequency", 12)  # monthly
+    
+    amount = sim_kernels.compound_amount(float(principal), float(rate), float(time), float(frequency))
+    interest = amount - principal
+    
+    result = {
+        "final_amount": round(amount, 2),
+        "interest_earned": round(interest, 2),
+        "principal": principal,
+        "total_return_percentage": round((interest/principal)*100, 2) if principal > 0 else 0
+    }
+    
+    if inputs.get("schedule"):
+        months = schedule_months(round(time * 12))
+        balances = sim_kernels.compound_schedule(float(principal), float(rate), months, float(frequency))
+        result["schedule"] = np.round(balances, 2).tolist()
+    
+    if inputs.get("rates"):
+        # Sensitivity of the final amount to the annual rate (in %)
+        rates = sweep_rates(inputs["rates"])
+        amounts = sim_kernels.compound_rate_sweep(float(principal), rates / 100, float(time), float(frequency))
+        result["sensitivity"] = [
+            {"rate": r, "final_amount": a}
+            for r, a in zip(rates.tolist(), np.round(amounts, 2).tolist())
+        ]
+    
+    return result
+
+def simple_interest(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Simple interest on a principal"""
+    principal = inputs.get("principal", 0)
+    rate = inputs.get("rate", 0) / 100
+    time = inputs.get("time", 0)
+    
+    interest = principal * rate * time
+    amount = principal + interest
+    
+    result = {
+        "final_amount": round(amount, 2),
+        "interest_earned": round(interest, 2),
+        "principal": principal
+    }
+    
+    return result
+
+def emi_calculator(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Monthly EMI for a loan, optionally with the outstanding balance schedule"""
+    principal = inputs.get("principal", 0)
+    rate = inputs.get("rate", 0) / 100 / 12  # monthly rate
+    months = inputs.get("months", 0)
+    
+    emi = sim_kernels.emi(float(principal), float(rate), float(months))
+    
+    total_payment = emi * months
+    total_interest = total_payment - principal
+    
+    result = {
+        "emi": round(emi, 2),
+        "total_payment": round(total_payment, 2),
+        "total_interest": round(total_interest, 2),
+        "principal": principal
+    }
+    
+    if inputs.get("schedule"):
+        balances = sim_kernels.emi_schedule(float(principal), float(rate), schedule_months(months))
+        result["schedule"] = np.round(balances, 2).tolist()
+    
+    return result
+
+def sip_calculator(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Future value of a monthly SIP, optionally with a monthly value schedule"""
+    monthly_investment = inputs.get("monthly_investment", 0)
+    rate = inputs.get("rate", 0) / 100 / 12  # monthly rate
+    months = inputs.get("months", 0)
+    
+    future_value = sim_kernels.sip_fv(float(monthly_investment), float(rate), float(months))
+    
+    total_invested = monthly_investment * months
+    returns = future_value - total_invested
+    
+    result = {
+        "future_value": round(future_value, 2),
+        "total_invested": round(total_invested, 2),
+        "returns": round(returns, 2),
+        "return_percentage": round((returns/total_invested)*100, 2) if total_invested > 0 else 0
+    }
+    
+    if inputs.get("schedule"):
+        values = sim_kernels.sip_schedule(float(monthly_investment), float(rate), schedule_months(months))
+        result["schedule"] = np.round(values, 2).tolist()
+    
+    return result
+
+def budget_builder(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Savings and savings rate for an income and set of expenses"""
+    income = inputs.get("income", 0)
+    expenses = inputs.get("expenses", {})
+    
+    total_expenses = sum(expenses.values())
+    savings = income - total_expenses
+    savings_rate = (savings / income * 100) if income > 0 else 0
+    
+    result = {
+        "income": income,
+        "total_expenses": round(total_expenses, 2),
+        "savings": round(savings, 2),
+        "savings_rate": round(savings_rate, 2),
+        "status": "surplus" if savings >= 0 else "deficit"
+    }
+    
+    return result
+
+SIMULATIONS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "compound_interest": compound_interest,
+    "simple_interest": simple_interest,
+    "emi_calculator": emi_calculator,
+    "sip_calculator": sip_calculator,
+    "budget_builder": budget_builder
+}
+
+# === Background Tasks ===
+
+background_tasks: set = set()
+
+def on_background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background task failed: {task.exception()}")
+
+def run_in_background(coro) -> asyncio.Task:
+    """Schedule a coroutine without awaiting it, logging any failure"""
+    task = asyncio.create_task(coro)
+    # The event loop only keeps weak references to tasks
+    background_tasks.add(task)
+    task.add_done_callback(on_background_task_done)
+    return task
+
 # === API Routes ===
 
 @api_router.get("/")
@@ -215,109 +771,135 @@ async def root():
     return {"message": "FinStart API - Financial Education for Young Adults"}
 
 @api_router.get("/modules", response_model=List[Module])
-async def get_modules():
+async def get_modules(request: Request):
     """Get all learning modules"""
-    modules = get_modules_data()
-    return [Module(**m) for m in modules]
+    # Served pre-compressed, so this path is excluded from the compression middleware
+    encoding = pick_encoding(request.headers.get("accept-encoding", ""), list(MODULES_ENCODED))
+    if encoding:
+        return Response(
+            MODULES_ENCODED[encoding],
+            media_type="application/json",
+            headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+        )
+    return Response(MODULES_BYTES, media_type="application/json", headers={"Vary": "Accept-Encoding"})
 
 @api_router.get("/modules/{module_id}/lessons")
 async def get_module_lessons(module_id: str):
     """Get all lessons for a specific module"""
-    lessons = await db.lessons.find({"module_id": module_id}).to_list(100)
-    # Remove MongoDB _id from each lesson
-    for lesson in lessons:
-        if "_id" in lesson:
-            del lesson["_id"]
+    lessons = await db.lessons.find(
+        {"module_id": module_id}, {"_id": 0}
+    ).sort("order", 1).limit(100).to_list(100)
     return lessons
 
 @api_router.get("/lessons/{lesson_id}")
 async def get_lesson(lesson_id: str):
     """Get a specific lesson"""
-    lesson = await db.lessons.find_one({"id": lesson_id})
+    lesson = await db.lessons.find_one({"id": lesson_id}, {"_id": 0})
     if not lesson:
         raise HTTPException(status_code=404, detail="Lesson not found")
-    # Remove MongoDB _id
-    if "_id" in lesson:
-        del lesson["_id"]
     return lesson
 
 @api_router.post("/lessons/generate")
 async def generate_lesson(request: LessonGenerateRequest):
     """Generate a new lesson using AI"""
     lesson_content = await generate_lesson_content(request.topic, request.difficulty)
-    
-    # Create lesson object
-    lesson_id = f"{request.module_id}_{request.topic.lower().replace(' ', '_')}"
-    lesson = {
-        "id": lesson_id,
-        "module_id": request.module_id,
-        "title": lesson_content.get("title", request.topic),
-        "content": lesson_content.get("content", ""),
-        "duration_minutes": 3,
-        "key_points": lesson_content.get("key_points", []),
-        "real_example": lesson_content.get("real_example", ""),
-        "quiz_questions": [],
-        "daily_tip": lesson_content.get("daily_tip", ""),
-        "order": 1,
-        "created_at": datetime.utcnow()
-    }
-    
-    # Save to database
-    await db.lessons.update_one(
-        {"id": lesson_id},
-        {"$set": lesson},
-        upsert=True
-    )
-    
-    return lesson
+    return await save_generated_lesson(request, lesson_content)
 
 @api_router.get("/progress")
 async def get_progress():
     """Get user progress"""
-    progress = await db.progress.find_one({"user_id": "default_user"})
+    user_id = "default_user"
+    await cache_progress(user_id)
+    
+    # Completed lessons and quiz scores come from Redis
+    progress = await db.progress.find_one(
+        {"user_id": user_id},
+        {"_id": 0, "completed_lessons": 0, "quiz_scores": 0}
+    )
     if not progress:
-        # Create default progress
-        progress = {
-            "user_id": "default_user",
-            "completed_lessons": [],
-            "quiz_scores": {},
-            "simulations_completed": [],
-            "last_active": datetime.utcnow()
-        }
-        await db.progress.insert_one(progress)
+        # Create default progress; an upsert is safe against concurrent
+        # first requests under the unique user_id index
+        progress = await db.progress.find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": {
+                "completed_lessons": [],
+                "quiz_scores": {},
+                "simulations_completed": [],
+                "last_active": datetime.utcnow()
+            }},
+            projection={"_id": 0, "completed_lessons": 0, "quiz_scores": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    
+    done_key, quiz_key = progress_keys(user_id)
+    pipe = redis_client.pipeline()
+    pipe.smembers(done_key)
+    pipe.hgetall(quiz_key)
+    pipe.get(f"active:{user_id}")
+    completed, scores, last_active = await pipe.execute()
+    progress["completed_lessons"] = [lesson_id for lesson_id in completed if lesson_id]
+    progress["quiz_scores"] = {
+        lesson_id: float(score) for lesson_id, score in scores.items() if lesson_id
+    }
     
-    # Remove MongoDB _id before returning
-    if "_id" in progress:
-        del progress["_id"]
+    # Activity not yet flushed to MongoDB is newer than the stored value
+    if last_active:
+        progress["last_active"] = datetime.utcfromtimestamp(int(last_active))
     return progress
 
+@api_router.get("/progress/lessons/{lesson_id}")
+async def is_lesson_completed(lesson_id: str):
+    """Check whether a lesson has been completed"""
+    user_id = "default_user"
+    await cache_progress(user_id)
+    done_key, _ = progress_keys(user_id)
+    completed = await redis_client.sismember(done_key, lesson_id)
+    return {"lesson_id": lesson_id, "completed": bool(completed)}
+
 @api_router.post("/progress/complete-lesson/{lesson_id}")
 async def complete_lesson(lesson_id: str):
     """Mark a lesson as completed"""
-    result = await db.progress.update_one(
-        {"user_id": "default_user"},
-        {
-            "$addToSet": {"completed_lessons": lesson_id},
-            "$set": {"last_active": datetime.utcnow()}
-        },
+    user_id = "default_user"
+    
+    # Write through to MongoDB via the batched flusher before updating Redis
+    await queue_progress_write(UpdateOne(
+        {"user_id": user_id},
+        {"$addToSet": {"completed_lessons": lesson_id}},
         upsert=True
-    )
+    ))
+    
+    done_key, _ = progress_keys(user_id)
+    pipe = redis_client.pipeline()
+    check_progress_cached(pipe, user_id)
+    pipe.sadd(done_key, lesson_id)
+    touch_last_active(pipe, user_id)
+    done_cached, quiz_cached, *_ = await pipe.execute()
+    if not (done_cached and quiz_cached):
+        # A key was missing (this write may have started it partial); reload it
+        await load_progress(user_id)
     return {"success": True, "lesson_id": lesson_id}
 
 @api_router.post("/quiz/submit")
 async def submit_quiz(submission: QuizSubmission):
     """Submit quiz answers and get score"""
-    # Store quiz score
-    await db.progress.update_one(
-        {"user_id": "default_user"},
-        {
-            "$set": {
-                f"quiz_scores.{submission.lesson_id}": submission.score,
-                "last_active": datetime.utcnow()
-            }
-        },
+    user_id = "default_user"
+    
+    # Store quiz score in MongoDB before updating Redis
+    await queue_progress_write(UpdateOne(
+        {"user_id": user_id},
+        {"$set": {f"quiz_scores.{submission.lesson_id}": submission.score}},
         upsert=True
-    )
+    ))
+    
+    done_key, quiz_key = progress_keys(user_id)
+    pipe = redis_client.pipeline()
+    check_progress_cached(pipe, user_id)
+    pipe.hset(quiz_key, submission.lesson_id, submission.score)
+    touch_last_active(pipe, user_id)
+    done_cached, quiz_cached, *_ = await pipe.execute()
+    if not (done_cached and quiz_cached):
+        await load_progress(user_id)
     return {"score": submission.score, "lesson_id": submission.lesson_id}
 
 @api_router.post("/simulations/calculate")
@@ -326,151 +908,29 @@ async def calculate_simulation(simulation: SimulationResult):
     sim_type = simulation.simulation_type
     inputs = simulation.inputs
     
-    result = {}
-    
-    if sim_type == "compound_interest":
-        principal = inputs.get("principal", 0)
-        rate = inputs.get("rate", 0) / 100
-        time = inputs.get("time", 0)
-        frequency = inputs.get("frequency", 12)  # monthly
-        
-        amount = principal * (1 + rate/frequency) ** (frequency * time)
-        interest = amount - principal
-        
-        result = {
-            "final_amount": round(amount, 2),
-            "interest_earned": round(interest, 2),
-            "principal": principal,
-            "total_return_percentage": round((interest/principal)*100, 2) if principal > 0 else 0
-        }
-    
-    elif sim_type == "simple_interest":
-        principal = inputs.get("principal", 0)
-        rate = inputs.get("rate", 0) / 100
-        time = inputs.get("time", 0)
-        
-        interest = principal * rate * time
-        amount = principal + interest
-        
-        result = {
-            "final_amount": round(amount, 2),
-            "interest_earned": round(interest, 2),
-            "principal": principal
-        }
-    
-    elif sim_type == "emi_calculator":
-        principal = inputs.get("principal", 0)
-        rate = inputs.get("rate", 0) / 100 / 12  # monthly rate
-        months = inputs.get("months", 0)
-        
-        if rate > 0:
-            emi = principal * rate * (1 + rate)**months / ((1 + rate)**months - 1)
-        else:
-            emi = principal / months if months > 0 else 0
-        
-        total_payment = emi * months
-        total_interest = total_payment - principal
-        
-        result = {
-            "emi": round(emi, 2),
-            "total_payment": round(total_payment, 2),
-            "total_interest": round(total_interest, 2),
-            "principal": principal
-        }
+    simulate = SIMULATIONS.get(sim_type)
+    if not simulate:
+        raise HTTPException(status_code=400, detail=f"Unknown simulation type: {sim_type}")
+    result = simulate(inputs)
     
-    elif sim_type == "sip_calculator":
-        monthly_investment = inputs.get("monthly_investment", 0)
-        rate = inputs.get("rate", 0) / 100 / 12  # monthly rate
-        months = inputs.get("months", 0)
-        
-        if rate > 0:
-            future_value = monthly_investment * (((1 + rate)**months - 1) / rate) * (1 + rate)
-        else:
-            future_value = monthly_investment * months
-        
-        total_invested = monthly_investment * months
-        returns = future_value - total_invested
-        
-        result = {
-            "future_value": round(future_value, 2),
-            "total_invested": round(total_invested, 2),
-            "returns": round(returns, 2),
-            "return_percentage": round((returns/total_invested)*100, 2) if total_invested > 0 else 0
-        }
-    
-    elif sim_type == "budget_builder":
-        income = inputs.get("income", 0)
-        expenses = inputs.get("expenses", {})
-        
-        total_expenses = sum(expenses.values())
-        savings = income - total_expenses
-        savings_rate = (savings / income * 100) if income > 0 else 0
-        
-        result = {
-            "income": income,
-            "total_expenses": round(total_expenses, 2),
-            "savings": round(savings, 2),
-            "savings_rate": round(savings_rate, 2),
-            "status": "surplus" if savings >= 0 else "deficit"
-        }
-    
-    # Store simulation
-    await db.simulations.insert_one({
+    # Store simulation in the background so the response skips the write
+    run_in_background(db.simulations.insert_one({
         "user_id": "default_user",
         "simulation_type": sim_type,
         "inputs": inputs,
         "outputs": result,
         "created_at": datetime.utcnow()
-    })
+    }))
     
     return result
 
 @api_router.get("/scenarios/{scenario_type}")
 async def get_scenario(scenario_type: str, income: float = 50000, age: int = 20):
     """Get personalized financial scenario advice"""
-    scenarios = {
-        "student": {
-            "title": "Student Financial Scenario",
-            "advice": [
-                "Focus on building emergency fund (3 months expenses)",
-                "Start with small savings habit (10-20% of any income)",
-                "Avoid unnecessary debt, especially consumer loans",
-                "Learn about compound interest early"
-            ],
-            "suggested_actions": [
-                "Open a basic savings account",
-                "Track all expenses for one month",
-                "Set up automatic savings transfer"
-            ]
-        },
-        "first_job": {
-            "title": "First Job Financial Scenario",
-            "advice": [
-                "Build 6-month emergency fund",
-                "Start retirement savings immediately (even small amounts)",
-                "Avoid lifestyle inflation",
-                f"Save at least 20% of income: ₹{income * 0.2:.2f}"
-            ],
-            "suggested_actions": [
-                "Set up automatic investment (SIP) of ₹500-1000/month",
-                "Get health insurance",
-                "Create and follow a budget"
-            ]
-        },
-        "tax_planning": {
-            "title": "Legal Tax Planning",
-            "advice": [
-                "Utilize Section 80C deductions (up to ₹1.5 lakh)",
-                "Consider PPF, ELSS, or EPF contributions",
-                "Keep records of all tax-saving investments",
-                "File returns on time to avoid penalties"
-            ],
-            "disclaimer": "This is educational information only. Consult a tax professional for personalized advice. Never engage in tax evasion - it is illegal."
-        }
-    }
-    
-    scenario = scenarios.get(scenario_type, scenarios["student"])
-    return scenario
+    content = SCENARIO_BYTES.get(scenario_type, SCENARIO_BYTES["student"])
+    if scenario_type == "first_job":
+        content = content.replace(b"{INCOME20}", f"{income * 0.2:.2f}".encode())
+    return Response(content, media_type="application/json")
 
 # Include router
 app.include_router(api_router)
@@ -483,6 +943,102 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Brotli for clients that accept it, gzip otherwise
+app.add_middleware(
+    BrotliMiddleware,
+    quality=4,
+    minimum_size=500,
+    gzip_fallback=True,
+    excluded_handlers=[r"^/api/modules$"]
+)
+
+@app.on_event("startup")
+async def connect_lesson_cache():
+    global llmcache
+    try:
+        llmcache = await asyncio.to_thread(build_lesson_cache)
+    except Exception as e:
+        logger.warning(f"Lesson cache unavailable, generating without it: {e}")
+
+@app.on_event("startup")
+async def create_indexes():
+    # create_index is a no-op when the index already exists
+    indexes = [
+        (db.lessons, [("id", 1)], True),
+        (db.lessons, [("module_id", 1), ("order", 1)], False),
+        (db.progress, [("user_id", 1)], True),
+        (db.simulations, [("user_id", 1), ("created_at", -1)], False)
+    ]
+    for collection, keys, unique in indexes:
+        try:
+            await collection.create_index(keys, unique=unique)
+        except OperationFailure as e:
+            # Older databases may hold duplicate progress/lesson documents;
+            # remove the duplicates and restart to get the unique index
+            logger.error(f"Could not create index {keys} on {collection.name}: {e}")
+
+@app.on_event("startup")
+async def warm_up_simulations():
+    # Load or JIT-compile the kernels before serving, not on the first request
+    sim_kernels.warm_up()
+
+@app.on_event("startup")
+async def start_progress_flusher():
+    global progress_flusher
+    progress_flusher = asyncio.create_task(flush_progress_writes())
+
+@app.on_event("shutdown")
+async def stop_progress_flusher():
+    if progress_flusher:
+        # Stop via the queue rather than cancel() so the batch being written
+        # completes and its futures are resolved
+        await progress_queue.put(None)
+        await asyncio.gather(progress_flusher, return_exceptions=True)
+    # Write whatever was queued after the flusher stopped
+    batch = []
+    while not progress_queue.empty():
+        item = progress_queue.get_nowait()
+        if item is not None:
+            batch.append(item)
+    if batch:
+        await write_progress_batch(batch)
+
+@app.on_event("startup")
+async def start_activity_flusher():
+    global activity_flusher
+    activity_flusher = asyncio.create_task(flush_last_active())
+
+@app.on_event("shutdown")
+async def stop_activity_flusher():
+    if activity_flusher:
+        activity_flusher.cancel()
+        await asyncio.gather(activity_flusher, return_exceptions=True)
+    try:
+        await write_last_active()
+    except Exception as e:
+        logger.error(f"Error writing last_active on shutdown: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Let fire-and-forget writes finish before the client goes away
+    await asyncio.gather(*background_tasks, return_exceptions=True)
     client.close()
+    await redis_client.aclose()
+
+# Run with uvloop and the httptools parser across multiple worker processes:
+#   uvicorn server:app --loop uvloop --http httptools --workers $(nproc) --backlog 2048
+# WEB_CONCURRENCY defaults to one worker per core. Each worker loads its own
+# copy of the lesson cache embedding model and JIT-compiles its own simulation
+# kernels, so memory and warm-up cost grow with every extra worker.
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8001)),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        backlog=2048
+    )
@@ -0,0 +1,71 @@
+import math
+
+import numba
+import numpy as np
+
+# Compiled kernels for the financial simulations. cache=True stores the
+# compiled machine code on disk so only the first process start pays for JIT.
+
+@numba.njit(cache=True)
+def emi(principal: float, rate: float, n: float) -> float:
+    """Monthly EMI for a loan at a monthly rate over n months"""
+    if rate > 0 and n > 0:
+        # growth = (1 + rate)**n - 1, without cancellation for tiny rates
+        growth = math.expm1(n * math.log1p(rate))
+        return principal * rate * (growth + 1) / growth
+    return principal / n if n > 0 else 0.0
+
+@numba.njit(cache=True)
+def sip_fv(m: float, r: float, n: float) -> float:
+    """Future value of a monthly SIP of m at a monthly rate r over n months"""
+    if r > 0:
+        growth = math.expm1(n * math.log1p(r))
+        return m * (growth / r) * (1 + r)
+    return m * n
+
+@numba.njit(cache=True)
+def compound_amount(p: float, r: float, t: float, f: float) -> float:
+    """Amount after t years at annual rate r compounded f times a year"""
+    return p * (1 + r / f) ** (f * t)
+
+@numba.njit(cache=True)
+def compound_schedule(p: float, r: float, n: int, f: float) -> np.ndarray:
+    """Balance at the end of each of n months at annual rate r compounded f times a year"""
+    balances = np.empty(n)
+    for month in range(n):
+        balances[month] = p * (1 + r / f) ** (f * (month + 1) / 12)
+    return balances
+
+@numba.njit(cache=True)
+def sip_schedule(m: float, r: float, n: int) -> np.ndarray:
+    """SIP value at the end of each of n months at a monthly rate r"""
+    values = np.empty(n)
+    value = 0.0
+    for month in range(n):
+        value = (value + m) * (1 + r)
+        values[month] = value
+    return values
+
+@numba.njit(cache=True)
+def emi_schedule(principal: float, rate: float, n: int) -> np.ndarray:
+    """Outstanding loan balance after each of n monthly EMI payments"""
+    payment = emi(principal, rate, n)
+    balances = np.empty(n)
+    balance = principal
+    for month in range(n):
+        balance = balance * (1 + rate) - payment
+        balances[month] = max(balance, 0.0)
+    return balances
+
+def compound_rate_sweep(p: float, rates: np.ndarray, t: float, f: float) -> np.ndarray:
+    """Final amounts for a grid of annual rates, vectorized over the grid"""
+    return p * np.power(1 + rates / f, f * t)
+
+def warm_up():
+    """Compile (or load from cache) every kernel so requests never pay for JIT"""
+    emi(1.0, 0.01, 1.0)
+    sip_fv(1.0, 0.01, 1.0)
+    compound_amount(1.0, 0.01, 1.0, 12.0)
+    compound_schedule(1.0, 0.01, 1, 12.0)
+    sip_schedule(1.0, 0.01, 1)
+    emi_schedule(1.0, 0.01, 1)